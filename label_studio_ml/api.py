@@ -3,6 +3,12 @@ import logging
 import os
 
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from .response import ModelResponse
 from .model import LabelStudioMLBase
@@ -10,6 +16,38 @@ from .exceptions import exception_handler
 
 logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    Prediction responses consist of many small dicts of floats, for which orjson is considerably faster than the
+    standard library json module. It is not enabled by default; a backend opts in by assigning it to the app returned
+    by init_app, e.g. `app.json = OrjsonProvider(app)`.
+
+    The output differs from the default provider in a few places:
+    - NaN and Infinity are serialized as null instead of the non-standard NaN/Infinity literals.
+    - Request bodies containing NaN or Infinity literals are rejected instead of parsed.
+    - Integers that do not fit into 64 bits raise an error instead of being serialized.
+    - Datetimes are serialized in RFC 3339 format instead of the HTTP date format.
+    """
+
+    def __init__(self, app):
+        if orjson is None:
+            raise ImportError('OrjsonProvider requires the orjson package to be installed')
+        super().__init__(app)
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 _server = Flask(__name__)
 MODEL_CLASS = LabelStudioMLBase
 BASIC_AUTH = None
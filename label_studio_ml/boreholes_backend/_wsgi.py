@@ -6,7 +6,7 @@ import os
 
 from model import LayerExtractionModel
 
-from label_studio_ml.api import init_app
+from label_studio_ml.api import OrjsonProvider, init_app
 
 logging.config.dictConfig(
     {
@@ -130,9 +130,11 @@ if __name__ == "__main__":
         basic_auth_user=args.basic_auth_user,
         basic_auth_pass=args.basic_auth_pass,
     )
+    app.json = OrjsonProvider(app)
 
     app.run(host=args.host, port=args.port, debug=args.debug)
 
 else:
     # for uWSGI use
     app = init_app(model_class=LayerExtractionModel)
+    app.json = OrjsonProvider(app)
@@ -1,14 +1,34 @@
 """Custom ML Model for the boreholes backend."""
 
+import logging
+import os
+import re
+import tempfile
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional
 
 from stratigraphy.main import start_pipeline
-from utils import build_model_predictions
+from utils import build_model_predictions, get_png_width
 
 from label_studio_ml.model import LabelStudioMLBase
 from label_studio_ml.response import ModelResponse
-from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Matches the ".../<project_name>/<file_name>_<page_number>.png" end of the ocr image path.
+OCR_PATH_REGEX = re.compile(r"([^/]+)/([^/_]+)_(\d+)\.png$")
+
+# Adjust the paths below for now. Make sure volume is mounted in docker container.
+# TODO: See what of these paths is actually needed. Renato mentioned
+# that some of these might be redundant.
+PDF_DIRECTORY = Path("/data/pdf/")
+PNG_DIRECTORY = Path("/data")
+GROUND_TRUTH_PATH = Path("/data/validation/ground_truth.json")
+OUT_DIRECTORY = Path("/data/_temp/")
+
+# The predictions file written by the pipeline is never read; keep it on tmpfs where available.
+PREDICTIONS_DIRECTORY = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
 
 
 class LayerExtractionModel(LabelStudioMLBase):
@@ -27,40 +47,37 @@ class LayerExtractionModel(LabelStudioMLBase):
             ModelResponse(predictions=predictions) with
             predictions: [Predictions array in JSON format](https://labelstud.io/guide/export.html#Label-Studio-JSON-format-of-annotated-tasks)
         """
-        print(f"""\
-        Run prediction on {tasks}""")
+        logger.debug("Run prediction on %s", tasks)
 
         png_path = tasks[0]["data"]["ocr"].split("=")[-1]
-        file_name = png_path.split("/")[-1]
-        project_name = tasks[0]["data"]["ocr"].split("/")[-2]
-        file_name, page_number = file_name.split("_")
-        page_number = int(page_number.split(".")[0])  # page_number is 0-based
-        file_name = file_name + ".pdf"
-        # Adjust the path below for now. Make sure volume is mounted in docker container.
-        # TODO: See what of these paths is actually needed. Renato mentioned 
-        # that some of these might be redundant.
-        input_directory = Path("/data/pdf/") / project_name / file_name
-        ground_truth_path = Path("/data/validation/ground_truth.json")
-        out_directory = Path("/data/_temp/")
-        predictions_path = Path("/data/_temp/predictions.json")
-        skip_draw_predictions = True
-
-        prediction = start_pipeline(
-            input_directory=input_directory,
-            ground_truth_path=ground_truth_path,
-            out_directory=out_directory,
-            predictions_path=predictions_path,
-            skip_draw_predictions=skip_draw_predictions,
-        )
+        match = OCR_PATH_REGEX.search(png_path)
+        if match is None:
+            raise ValueError(f"Unexpected OCR image path: {png_path}")
+        project_name = match.group(1)
+        file_name = match.group(2) + ".pdf"
+        page_number = int(match.group(3))  # page_number is 0-based
+        input_directory = PDF_DIRECTORY / project_name / file_name
+        # one file per thread, such that concurrent requests do not write to the same file
+        predictions_path = PREDICTIONS_DIRECTORY / f"predictions_{os.getpid()}_{threading.get_ident()}.json"
+
+        try:
+            prediction = start_pipeline(
+                input_directory=input_directory,
+                ground_truth_path=GROUND_TRUTH_PATH,
+                out_directory=OUT_DIRECTORY,
+                predictions_path=predictions_path,
+                skip_draw_predictions=True,
+            )
+        finally:
+            predictions_path.unlink(missing_ok=True)
         try:
             pdf_file_name = list(prediction.keys())[0]
             prediction = prediction[pdf_file_name]
             # get image width from png file to retrieve information about image scaling from the pdf
-            image = Image.open(Path('/data') / png_path) 
-            ls_page_width = image.size[0]
+            ls_page_width = get_png_width(PNG_DIRECTORY / png_path)
             model_predictions = build_model_predictions(prediction, page_number, ls_page_width=ls_page_width)
         except IndexError:
-            print("No prediction found.")
+            logger.info("No prediction found.")
             model_predictions = []
         return ModelResponse(predictions=model_predictions)
 
@@ -82,13 +99,13 @@ class LayerExtractionModel(LabelStudioMLBase):
         # use cache to retrieve the data from the previous fit() runs
         old_data = self.get("my_data")
         old_model_version = self.get("model_version")
-        print(f"Old data: {old_data}")
-        print(f"Old model version: {old_model_version}")
+        logger.debug("Old data: %s", old_data)
+        logger.debug("Old model version: %s", old_model_version)
 
         # store new data to the cache
         self.set("my_data", "my_new_data_value")
         self.set("model_version", "my_new_model_version")
-        print(f'New data: {self.get("my_data")}')
-        print(f'New model version: {self.get("model_version")}')
+        logger.debug("New data: %s", self.get("my_data"))
+        logger.debug("New model version: %s", self.get("model_version"))
 
-        print("fit() completed successfully.")
+        logger.debug("fit() completed successfully.")
@@ -0,0 +1,129 @@
+"""Tests for the conversion of the stratigraphy predictions into label-studio results."""
+
+import uuid
+from types import SimpleNamespace
+
+from utils import build_model_predictions
+
+# The png shown in label-studio is twice as large as the pdf page.
+PAGE_SIZE = {"width": 200, "height": 400}
+LS_PAGE_WIDTH = 400
+
+
+def _rect(x0: float, y0: float, x1: float, y1: float) -> SimpleNamespace:
+    return SimpleNamespace(x0=x0, y0=y0, width=x1 - x0, height=y1 - y0)
+
+
+def _layer(text: str, rect: SimpleNamespace, depth_interval: SimpleNamespace | None, page_number: int = 1):
+    material_description = SimpleNamespace(text=text, rect=rect, page_number=page_number)
+    return SimpleNamespace(id=uuid.uuid4(), material_description=material_description, depth_interval=depth_interval)
+
+
+def _depth(value: float, rect: SimpleNamespace) -> SimpleNamespace:
+    return SimpleNamespace(value=value, rect=rect)
+
+
+def _file_predictions(layers: list, coordinates: SimpleNamespace | None = None) -> SimpleNamespace:
+    return SimpleNamespace(
+        layers=layers,
+        metadata=SimpleNamespace(coordinates=coordinates),
+        page_sizes=[PAGE_SIZE, PAGE_SIZE],
+    )
+
+
+def _results_by_type(results: list[dict], result_id: str) -> dict[str, dict]:
+    return {result["type"]: result for result in results if result.get("id") == result_id}
+
+
+def test_page_without_predictions():  # noqa: D103
+    file_predictions = _file_predictions([_layer("Kies", _rect(20, 40, 100, 80), None, page_number=2)])
+    assert build_model_predictions(file_predictions, 0, LS_PAGE_WIDTH) == [{"model_version": "0.0.1", "result": []}]
+
+
+def test_layers():  # noqa: D103
+    end_only = _layer(
+        "Sand",
+        _rect(20, 40, 100, 80),
+        SimpleNamespace(start=None, end=_depth(2.5, _rect(10, 40, 18, 48))),
+    )
+    complete = _layer(
+        "Kies",
+        _rect(20, 100, 100, 140),
+        SimpleNamespace(
+            start=_depth(2.5, _rect(10, 100, 18, 108)),
+            end=_depth(4.0, _rect(10, 132, 18, 140)),
+            background_rect=_rect(10, 100, 18, 140),
+        ),
+    )
+    incomplete = _layer(
+        "Lehm",
+        _rect(20, 160, 100, 200),
+        SimpleNamespace(start=_depth(4.0, _rect(10, 160, 18, 168)), end=None),
+    )
+    without_depths = _layer("Fels", _rect(20, 220, 100, 260), None)
+    other_page = _layer("Torf", _rect(20, 40, 100, 80), None, page_number=2)
+    file_predictions = _file_predictions([end_only, complete, incomplete, without_depths, other_page])
+
+    (prediction,) = build_model_predictions(file_predictions, 0, LS_PAGE_WIDTH)
+    results = prediction["result"]
+    assert prediction["model_version"] == "0.0.1"
+
+    # each bounding box results in a rectangle, a labels and a textarea result, followed by the relations
+    expected_ids = [
+        f"{end_only.id.hex}_Material Description",
+        f"{end_only.id.hex}_Depth Interval",
+        f"{complete.id.hex}_Material Description",
+        f"{complete.id.hex}_Depth Interval",
+        f"{incomplete.id.hex}_Material Description",
+        f"{without_depths.id.hex}_Material Description",
+    ]
+    assert [result.get("id") for result in results[:-2]] == [result_id for result_id in expected_ids for _ in range(3)]
+    assert [result["type"] for result in results[:-2]] == ["rectangle", "labels", "textarea"] * len(expected_ids)
+    assert results[-2:] == [
+        {
+            "type": "relation",
+            "to_id": f"{layer.id.hex}_Depth Interval",
+            "from_id": f"{layer.id.hex}_Material Description",
+            "direction": "right",
+        }
+        for layer in (end_only, complete)
+    ]
+
+    material_description = _results_by_type(results, f"{end_only.id.hex}_Material Description")
+    assert material_description["rectangle"]["value"] == {
+        "x": 10.0,
+        "y": 10.0,
+        "width": 40.0,
+        "height": 10.0,
+        "rotation": 0,
+    }
+    assert material_description["rectangle"]["original_width"] == 400
+    assert material_description["rectangle"]["original_height"] == 800
+    assert material_description["labels"]["value"]["labels"] == ["Material Description"]
+    assert material_description["textarea"]["value"]["text"] == ["Sand"]
+
+    end_only_depths = _results_by_type(results, f"{end_only.id.hex}_Depth Interval")
+    assert end_only_depths["textarea"]["value"]["text"] == ["start: 0 end: 2.5"]
+    assert end_only_depths["rectangle"]["value"] == {"x": 5.0, "y": 10.0, "width": 4.0, "height": 2.0, "rotation": 0}
+
+    complete_depths = _results_by_type(results, f"{complete.id.hex}_Depth Interval")
+    assert complete_depths["labels"]["value"]["labels"] == ["Depth Interval"]
+    assert complete_depths["textarea"]["value"]["text"] == ["start: 2.5 end: 4.0"]
+    # the bounding box spans both depths
+    assert complete_depths["rectangle"]["value"] == {"x": 5.0, "y": 25.0, "width": 4.0, "height": 10.0, "rotation": 0}
+
+
+def test_coordinates():  # noqa: D103
+    coordinates = SimpleNamespace(page=1, rect=_rect(100, 20, 180, 40))
+    file_predictions = _file_predictions([], coordinates=coordinates)
+
+    (prediction,) = build_model_predictions(file_predictions, 0, LS_PAGE_WIDTH)
+    results = prediction["result"]
+    assert [result["type"] for result in results] == ["rectangle", "labels", "textarea"]
+    assert len({result["id"] for result in results}) == 1
+    assert results[0]["value"] == {"x": 50.0, "y": 5.0, "width": 40.0, "height": 5.0, "rotation": 0}
+    assert results[1]["value"]["labels"] == ["Coordinates"]
+    assert results[2]["value"]["text"] == [str(coordinates)]
+
+    # the coordinates are only predicted on their own page
+    assert build_model_predictions(file_predictions, 1, LS_PAGE_WIDTH) == [{"model_version": "0.0.1", "result": []}]
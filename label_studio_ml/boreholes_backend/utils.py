@@ -1,25 +1,82 @@
 """Utility functions for boreholes_backend."""
 
+import functools
+import itertools
 import logging
-import uuid
+import secrets
+from collections.abc import Iterator
+from pathlib import Path
 
+import numpy as np
+from PIL import Image
 from stratigraphy.util.predictions import BoreholeMetaData, FilePredictions, LayerPrediction
 
 logger = logging.getLogger(__name__)
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
-def convert_to_ls(pixel_position: int, original_length: int):
-    """Convert the pixel position to the label-studio format."""
-    return 100 * pixel_position / original_length
+# Fields that are identical for every label-studio result of a given type.
+_RECTANGLE_TEMPLATE = {
+    "type": "rectangle",
+    "from_name": "bbox",
+    "to_name": "image",
+    "image_rotation": 0,
+    "origin": "manual",
+}
+_LABELS_TEMPLATE = {
+    "type": "labels",
+    "from_name": "label",
+    "to_name": "image",
+    "image_rotation": 0,
+    "origin": "manual",
+}
+_TEXTAREA_TEMPLATE = {
+    "type": "textarea",
+    "from_name": "transcription",
+    "to_name": "image",
+    "image_rotation": 0,
+    "origin": "manual",
+}
+_DEPTH_INTERVAL_SUFFIX = "_Depth Interval"
+_MATERIAL_DESCRIPTION_SUFFIX = "_Material Description"
+
+# Returned for pages without any predictions. Shared between calls, so it must not be mutated.
+_EMPTY_MODEL_PREDICTIONS = [{"model_version": "0.0.1", "result": []}]
+
+
+def get_png_width(png_path: Path) -> int:
+    """Read the width of a png image from its IHDR header without decoding any pixel data.
+
+    Falls back to PIL if the file does not carry a png signature. The widths are cached per path and modification
+    time, such that an image that is regenerated under the same path is read again.
+
+    Args:
+        png_path (Path): The path to the image file.
+
+    Returns:
+        int: The width of the image in pixels.
+    """
+    return _get_png_width(png_path, png_path.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_png_width(png_path: Path, mtime_ns: int) -> int:
+    with open(png_path, "rb") as f:
+        header = f.read(24)
+    # The IHDR chunk always comes first: 8 bytes signature, 4 bytes chunk length, 4 bytes chunk type, 4 bytes width.
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return int.from_bytes(header[16:20], "big")
+    with Image.open(png_path) as image:
+        return image.size[0]
 
 
 def build_model_predictions(file_predictions: FilePredictions, page_number: int, ls_page_width: int) -> list[dict]:
-    """Build the label-studio predictions object from the stratygraphy.prediction.PagePrediction object.
+    """Build the label-studio predictions object from the stratigraphy FilePredictions object.
 
-    Note: Could become a method of the PagePrediction class.
+    Note: Could become a method of the FilePredictions class.
 
     Args:
-        prediction (FilePredictions): The prediction object from the stratigraphy pipeline.
+        file_predictions (FilePredictions): The prediction object from the stratigraphy pipeline.
         page_number (int): The page number to extract the predictions from. 0-based.
         ls_page_width (int): The page width as obtained by label_studio. Differs by a scaling factor from the page
                              width in the predictions object.
@@ -27,112 +84,93 @@ def build_model_predictions(file_predictions: FilePredictions, page_number: int,
     Returns:
         list[dict]: The label-studio predictions object.
     """
-    pre_annotation_result = []
+    metadata_prediction = file_predictions.metadata
+    coordinates = metadata_prediction.coordinates
+    has_coordinates = coordinates is not None and page_number + 1 == coordinates.page
+    layers = filter_layers_by_page(file_predictions.layers, page_number)
+    if not layers and not has_coordinates:
+        return _EMPTY_MODEL_PREDICTIONS
+
+    chunks = []
     layers_with_depth_intervals = []
-    scale_factor = ls_page_width / file_predictions.page_sizes[page_number]["width"]
+    page_size = file_predictions.page_sizes[page_number]
+    page_width = page_size["width"]
+    page_height = page_size["height"]
+    scale_factor = ls_page_width / page_width
+    original_width = int(page_width * scale_factor)
+    original_height = int(page_height * scale_factor)
+    # label-studio expects coordinates as percentages of the page dimensions
+    inv_pw = 100.0 / page_width
+    inv_ph = 100.0 / page_height
 
     # extract metadata. For now coordinates only
-    metadata_prediction = file_predictions.metadata
-    coordinates = metadata_prediction.coordinates
-    if coordinates is not None and page_number + 1 == coordinates.page:
+    if has_coordinates:
         label = "Coordinates"
+        rect = coordinates.rect
         value = {
-            "x": convert_to_ls(coordinates.rect.x0, file_predictions.page_sizes[page_number]["width"]),
-            "y": convert_to_ls(coordinates.rect.y0, file_predictions.page_sizes[page_number]["height"]),
-            "width": convert_to_ls(
-                coordinates.rect.width,
-                file_predictions.page_sizes[page_number]["width"],
-            ),
-            "height": convert_to_ls(
-                coordinates.rect.height,
-                file_predictions.page_sizes[page_number]["height"],
-            ),
+            "x": rect.x0 * inv_pw,
+            "y": rect.y0 * inv_ph,
+            "width": rect.width * inv_pw,
+            "height": rect.height * inv_ph,
             "rotation": 0,
         }
-        metadata_id = uuid.uuid4().hex
-        pre_annotation_result.extend(
+        metadata_id = secrets.token_hex(8)
+        chunks.append(
             create_metadata_ls_result(
-                metadata_prediction, file_predictions, page_number, value, label, metadata_id=metadata_id, scale_factor=scale_factor
+                metadata_prediction,
+                value,
+                label,
+                metadata_id=metadata_id,
+                original_width=original_width,
+                original_height=original_height,
             )
         )
 
-    # extract layers
-    layers = filter_layers_by_page(file_predictions.layers, page_number)
+    # extract layers. The rectangles of all layers are collected first and converted in a single batch.
+    labelled_layers = []
+    rects = []
     for layer in layers:
-        for label in ["Material Description", "Depth Interval"]:
-            if label == "Material Description":
-                value = {
-                    "x": convert_to_ls(layer.material_description.rect.x0, file_predictions.page_sizes[page_number]["width"]),
-                    "y": convert_to_ls(layer.material_description.rect.y0, file_predictions.page_sizes[page_number]["height"]),
-                    "width": convert_to_ls(
-                        layer.material_description.rect.width,
-                        file_predictions.page_sizes[page_number]["width"],
-                    ),
-                    "height": convert_to_ls(
-                        layer.material_description.rect.height,
-                        file_predictions.page_sizes[page_number]["height"],
-                    ),
-                    "rotation": 0,
-                }
-            elif label == "Depth Interval":
-                if layer.depth_interval is None:
-                    continue
-
-                elif layer.depth_interval.start is None and layer.depth_interval.end is not None:
-                    layers_with_depth_intervals.append(layer.id.hex)
-                    value = {
-                        "x": convert_to_ls(layer.depth_interval.end.rect.x0, file_predictions.page_sizes[page_number]["width"]),
-                        "y": convert_to_ls(
-                            layer.depth_interval.end.rect.y0,
-                            file_predictions.page_sizes[page_number]["height"],
-                        ),
-                        "width": convert_to_ls(
-                            layer.depth_interval.end.rect.width,
-                            file_predictions.page_sizes[page_number]["width"],
-                        ),
-                        "height": convert_to_ls(
-                            layer.depth_interval.end.rect.height,
-                            file_predictions.page_sizes[page_number]["height"],
-                        ),
-                        "rotation": 0,
-                    }
-
-                elif layer.depth_interval.start is not None and layer.depth_interval.end is not None:
-                    layers_with_depth_intervals.append(layer.id.hex)
-                    value = {
-                        "x": convert_to_ls(
-                            layer.depth_interval.background_rect.x0,
-                            file_predictions.page_sizes[page_number]["width"],
-                        ),
-                        "y": convert_to_ls(
-                            layer.depth_interval.background_rect.y0,
-                            file_predictions.page_sizes[page_number]["height"],
-                        ),
-                        "width": convert_to_ls(
-                            layer.depth_interval.background_rect.width,
-                            file_predictions.page_sizes[page_number]["width"],
-                        ),
-                        "height": convert_to_ls(
-                            layer.depth_interval.background_rect.height,
-                            file_predictions.page_sizes[page_number]["height"],
-                        ),
-                        "rotation": 0,
-                    }
-
-                else:
-                    logger.warning(f"Depth interval for layer {layer.id.hex} is not complete.")
-                    continue
-
-            pre_annotation_result.extend(create_ls_result(layer, file_predictions, page_number, value, label, scale_factor))
-
-    for layer_id in layers_with_depth_intervals:
-        relation = {
+        layer_id = layer.id.hex
+        material_description = layer.material_description
+        labelled_layers.append((layer_id, "Material Description", material_description.text))
+        rect = material_description.rect
+        rects.append((rect.x0, rect.y0, rect.width, rect.height))
+
+        depth_interval = layer.depth_interval
+        if depth_interval is None:
+            continue
+
+        start, end = depth_interval.start, depth_interval.end
+        if start is None and end is not None:
+            layers_with_depth_intervals.append(layer_id)
+            labelled_layers.append((layer_id, "Depth Interval", f"start: 0 end: {end.value}"))
+            rect = end.rect
+            rects.append((rect.x0, rect.y0, rect.width, rect.height))
+
+        elif start is not None and end is not None:
+            layers_with_depth_intervals.append(layer_id)
+            labelled_layers.append((layer_id, "Depth Interval", f"start: {start.value} end: {end.value}"))
+            rect = depth_interval.background_rect
+            rects.append((rect.x0, rect.y0, rect.width, rect.height))
+
+        else:
+            logger.warning(f"Depth interval for layer {layer_id} is not complete.")
+
+    ls_rects = _batch_ls(rects, inv_pw, inv_ph)
+    for (layer_id, label, text), (x, y, width, height) in zip(labelled_layers, ls_rects.tolist()):
+        value = {"x": x, "y": y, "width": width, "height": height, "rotation": 0}
+        chunks.append(create_ls_result(f"{layer_id}_{label}", value, label, text, original_width, original_height))
+
+    chunks.append(
+        {
             "type": "relation",
-            "to_id": f"{layer_id}_Depth Interval",
-            "from_id": f"{layer_id}_Material Description",
+            "to_id": layer_id + _DEPTH_INTERVAL_SUFFIX,
+            "from_id": layer_id + _MATERIAL_DESCRIPTION_SUFFIX,
             "direction": "right",
         }
-        pre_annotation_result.append(relation)
+        for layer_id in layers_with_depth_intervals
+    )
+    pre_annotation_result = list(itertools.chain.from_iterable(chunks))
 
     model_predictions = {}
     model_predictions["model_version"] = "0.0.1"
@@ -140,118 +178,98 @@ def build_model_predictions(file_predictions: FilePredictions, page_number: int,
     return [model_predictions]
 
 
-def filter_layers_by_page(layers: list[LayerPrediction], page_number: int) -> list[LayerPrediction]:
-    """Filter layers by page number.
-    
+def _batch_ls(rects: list[tuple[float, float, float, float]], inv_pw: float, inv_ph: float) -> np.ndarray:
+    """Convert a batch of rectangles to the label-studio format.
+
     Args:
-        layers (list[LayerPrediction]): The list of layer predictions.
-        page_number (int): The page number to filter by. 0-based.
+        rects (list[tuple[float, float, float, float]]): The rectangles as (x0, y0, width, height) tuples.
+        inv_pw (float): 100 divided by the page width.
+        inv_ph (float): 100 divided by the page height.
 
     Returns:
-        list[LayerPrediction]: The filtered list of layer predictions
+        np.ndarray: Array of shape (N, 4) with the rectangles as percentages of the page dimensions.
     """
-    return [layer for layer in layers if layer.material_description.page_number == page_number + 1]
+    return np.asarray(rects, dtype=np.float64).reshape(-1, 4) * np.array([inv_pw, inv_ph, inv_pw, inv_ph])
 
-def create_ls_result(
-    layer: LayerPrediction, file_prediction: FilePredictions, page_number: int, value: dict, label: str, scale_factor: float
-) -> list[dict]:
-    """Generate the label-studio predictions object for a single layer and label.
+
+def filter_layers_by_page(layers: list[LayerPrediction], page_number: int) -> list[LayerPrediction]:
+    """Filter layers by page number.
 
     Args:
-        layer (LayerPrediction): The layer prediction object.
-        file_prediction (FilePredictions): The page prediction object.
-        value (dict): The value object for the label.
-        label (str): The label name.
-        scale_factor (float): Scaling factor applied on the png images shown in label-studio.
+        layers (list[LayerPrediction]): The list of layer predictions.
+        page_number (int): The page number to filter by. 0-based.
 
     Returns:
-        list[dict]: The label-studio predictions object.
+        list[LayerPrediction]: The filtered list of layer predictions
     """
-    types = ["rectangle", "labels", "textarea"]
-    pre_annotation_result = []
-    for _type in types:
-        pre_annotation = {}
-        pre_annotation["id"] = layer.id.hex + f"_{label}"
-        pre_annotation["type"] = _type
-        pre_annotation["value"] = value.copy()
-        pre_annotation["original_width"] = int(
-            file_prediction.page_sizes[page_number]["width"] * scale_factor
-        )  # unclear if this key is required
-        pre_annotation["original_height"] = int(file_prediction.page_sizes[page_number]["height"] * scale_factor)
-        pre_annotation["image_rotation"] = 0
-        pre_annotation["origin"] = "manual"
-        if _type == "rectangle":
-            pre_annotation["from_name"] = "bbox"
-            pre_annotation["to_name"] = "image"
-        elif _type == "labels":
-            pre_annotation["from_name"] = "label"
-            pre_annotation["to_name"] = "image"
-            pre_annotation["value"]["labels"] = [label]
-        elif _type == "textarea":
-            pre_annotation["from_name"] = "transcription"
-            pre_annotation["to_name"] = "image"
-            if label == "Material Description":
-                pre_annotation["value"]["text"] = [layer.material_description.text]
-            elif label == "Depth Interval":
-                if layer.depth_interval.start is None:
-                    pre_annotation["value"]["text"] = [f"start: 0 end: {layer.depth_interval.end.value}"]
-                else:
-                    pre_annotation["value"]["text"] = [
-                        f"start: {layer.depth_interval.start.value} end: {layer.depth_interval.end.value}"
-                    ]
-        pre_annotation_result.append(pre_annotation)
-    return pre_annotation_result
+    target_page = page_number + 1
+    return [layer for layer in layers if layer.material_description.page_number == target_page]
 
 
 def create_metadata_ls_result(
     metadata_prediction: BoreholeMetaData,
-    file_prediction: FilePredictions,
-    page_number: int,
     value: dict,
     label: str,
     metadata_id: str,
-    scale_factor: float,
-) -> list[dict]:
+    original_width: int,
+    original_height: int,
+) -> Iterator[dict]:
     """Generate the label-studio predictions object for a single metadata object and label.
 
     Args:
         metadata_prediction (BoreholeMetaData): The metadata_prediction prediction object.
-        file_prediction (FilePredictions): The file prediction object.
-        page_number (int): The page number to filter by. 0-based.
-        value (dict): The value object for the label.
+        value (dict): The value object for the label. It is shared with the rectangle result and must not be mutated.
         label (str): The label name.
         metadata_id (str): The id of the metadata object.
-        scale_factor (float): Scaling factor applied on the png images shown in label-studio.
+        original_width (int): The width of the png image shown in label-studio.
+        original_height (int): The height of the png image shown in label-studio.
 
-    Returns:
-        list[dict]: The label-studio predictions object.
+    Yields:
+        dict: The label-studio results for the rectangle, labels and textarea types.
+    """
+    if label == "Coordinates":
+        text = str(metadata_prediction.coordinates)
+    else:
+        print("Metadata label not found.")
+        text = None
+    yield from create_ls_result(metadata_id, value, label, text, original_width, original_height)
+
+
+def create_ls_result(
+    result_id: str, value: dict, label: str, text: str | None, original_width: int, original_height: int
+) -> Iterator[dict]:
+    """Generate the rectangle, labels and textarea label-studio results for a single bounding box.
+
+    Args:
+        result_id (str): The id shared by the three results.
+        value (dict): The value object for the label. It is shared with the rectangle result and must not be mutated.
+        label (str): The label name.
+        text (str | None): The text of the textarea result. If None, the textarea result carries no text.
+        original_width (int): The width of the png image shown in label-studio.
+        original_height (int): The height of the png image shown in label-studio.
+
+    Yields:
+        dict: The label-studio results for the rectangle, labels and textarea types.
     """
-    types = ["rectangle", "labels", "textarea"]
-    pre_annotation_result = []
-    for _type in types:
-        pre_annotation = {}
-        pre_annotation["id"] = metadata_id
-        pre_annotation["type"] = _type
-        pre_annotation["value"] = value.copy()
-        pre_annotation["original_width"] = int(
-            file_prediction.page_sizes[page_number]["width"] * scale_factor
-        )  # unclear if this key is required
-        pre_annotation["original_height"] = int(file_prediction.page_sizes[page_number]["height"] * scale_factor)
-        pre_annotation["image_rotation"] = 0
-        pre_annotation["origin"] = "manual"
-        if _type == "rectangle":
-            pre_annotation["from_name"] = "bbox"
-            pre_annotation["to_name"] = "image"
-        elif _type == "labels":
-            pre_annotation["from_name"] = "label"
-            pre_annotation["to_name"] = "image"
-            pre_annotation["value"]["labels"] = [label]
-        elif _type == "textarea":
-            pre_annotation["from_name"] = "transcription"
-            pre_annotation["to_name"] = "image"
-            if label == "Coordinates":
-                pre_annotation["value"]["text"] = [str(metadata_prediction.coordinates)]
-            else:
-                print("Metadata label not found.")
-        pre_annotation_result.append(pre_annotation)
-    return pre_annotation_result
+    # original_width and original_height: unclear if these keys are required
+    yield {
+        **_RECTANGLE_TEMPLATE,
+        "id": result_id,
+        "original_width": original_width,
+        "original_height": original_height,
+        "value": value,
+    }
+    yield {
+        **_LABELS_TEMPLATE,
+        "id": result_id,
+        "original_width": original_width,
+        "original_height": original_height,
+        "value": {**value, "labels": [label]},
+    }
+    yield {
+        **_TEXTAREA_TEMPLATE,
+        "id": result_id,
+        "original_width": original_width,
+        "original_height": original_height,
+        "value": value if text is None else {**value, "text": [text]},
+    }
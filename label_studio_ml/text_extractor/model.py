@@ -4,10 +4,14 @@ import io
 import logging
 import os
 import re
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from functools import cache, lru_cache
 from pathlib import Path
 
-import boto3
 import fitz
+import numpy as np
 from PIL import Image
 from stratigraphy.util.coordinate_extraction import (
     COORDINATE_ENTRY_REGEX,
@@ -20,6 +24,26 @@ logger = logging.getLogger(__name__)
 global OCR_config
 OCR_config = "--psm 6 -l chi_sim+eng+deu"
 
+
+class _NumberTranslation(dict):
+    """Translation table that keeps digits and decimal points, and maps all other characters to a space."""
+
+    def __missing__(self, key):
+        value = chr(key) if chr(key) in "0123456789." else " "
+        self[key] = value
+        return value
+
+
+# Decimal commas are read as decimal points.
+NUMBER_TRANSLATION = _NumberTranslation({ord(","): "."})
+
+# Parsed pdf documents, keyed by path and modification time, in least recently used order.
+# For each document, the words of the pages that were accessed are kept as well.
+PDF_CACHE_SIZE = 16
+PageWords = tuple[float, float, np.ndarray, np.ndarray]
+_pdf_cache: OrderedDict[tuple[str, int], tuple[fitz.Document, dict[int, PageWords]]] = OrderedDict()
+_pdf_lock = threading.Lock()
+
 LABEL_STUDIO_ACCESS_TOKEN = os.environ.get("LABEL_STUDIO_ACCESS_TOKEN")
 LABEL_STUDIO_HOST = os.environ.get("LABEL_STUDIO_HOST")
 
@@ -28,15 +52,41 @@ AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 AWS_SESSION_TOKEN = os.environ.get("AWS_SESSION_TOKEN")
 AWS_ENDPOINT = os.environ.get("AWS_ENDPOINT")
 
-S3_TARGET = boto3.resource(
-    "s3",
-    endpoint_url=AWS_ENDPOINT,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    aws_session_token=AWS_SESSION_TOKEN,
-    config=boto3.session.Config(signature_version="s3v4"),
-    verify=False,
-)
+
+@cache
+def _s3_client():
+    """Create the S3 client and its transfer configuration on first use.
+
+    boto3 is only imported here, such that workers that only read local files do not pay for importing it.
+
+    Returns:
+        tuple: The S3 client and the boto3 TransferConfig for downloads.
+    """
+    import boto3
+    import botocore.config
+    import urllib3
+    from boto3.s3.transfer import TransferConfig
+
+    # TLS verification is disabled for the S3 endpoint; silence the warning that urllib3 would emit on every request.
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    client = boto3.client(
+        "s3",
+        endpoint_url=AWS_ENDPOINT,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        aws_session_token=AWS_SESSION_TOKEN,
+        config=botocore.config.Config(
+            signature_version="s3v4",
+            retries={"max_attempts": 3, "mode": "adaptive"},
+            tcp_keepalive=True,
+        ),
+        verify=False,
+    )
+    # Large images are downloaded with parallel ranged GETs.
+    transfer_config = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024, max_concurrency=8, io_chunksize=1024 * 1024, max_io_queue=1000
+    )
+    return client, transfer_config
 
 
 class BBOXOCR(LabelStudioMLBase):
@@ -49,10 +99,11 @@ class BBOXOCR(LabelStudioMLBase):
             bucket_name = img_path_url.split("/")[2]
             key = "/".join(img_path_url.split("/")[3:])
 
-            obj = S3_TARGET.Object(bucket_name, key).get()
-            data = obj["Body"].read()
-            image = Image.open(io.BytesIO(data))
-            return image
+            s3_client, transfer_config = _s3_client()
+            buffer = io.BytesIO()
+            s3_client.download_fileobj(bucket_name, key, buffer, Config=transfer_config)
+            buffer.seek(0)
+            return Image.open(buffer)
         else:
             # some hack to make image loading work:
             file_name = img_path_url.split("/")[-1]
@@ -68,73 +119,52 @@ class BBOXOCR(LabelStudioMLBase):
             return Image.open(filepath)
 
     def predict(self, tasks, **kwargs):
+        context = kwargs.get("context")
+        if not context or not context["result"]:
+            return []
+
         # extract task metadata: labels, from_name, to_name and other
         from_name, to_name, value = self.label_interface.get_first_tag_occurence("TextArea", "Image")
         task = tasks[0]
-        print(task["data"][value])
-        pdf_path_url = task["data"][value].split("_")[:-1]
-        page_number = task["data"][value].split("_")[-1]
-        page_number = int(page_number.split(".")[0])
-        pdf_path_url = "".join(pdf_path_url) + ".pdf"
-        pdf_name = pdf_path_url.split("/")[-1]
-        project_name = pdf_path_url.split("/")[-2]
-        pdf_path = Path("/data/pdf/") / project_name / pdf_name
-
-        context = kwargs.get("context")
-        if context:
-            if not context["result"]:
-                return []
-            document = fitz.open(pdf_path)
-            page = document[page_number]
-
-            result = context.get("result")[-1]
-            meta = self._extract_meta({**task, **result})
-            x = meta["x"] * meta["original_width"] / 100
-            y = meta["y"] * meta["original_height"] / 100
-            w = meta["width"] * meta["original_width"] / 100
-            h = meta["height"] * meta["original_height"] / 100
-
-            page_x = x * page.rect.width / meta["original_width"]
-            page_y = y * page.rect.height / meta["original_height"]
-            page_w = w * page.rect.width / meta["original_width"]
-            page_h = h * page.rect.height / meta["original_height"]
-
-            page_rect = fitz.Rect([page_x, page_y, page_x + page_w, page_y + page_h])
-            result_text = fitz.utils.get_text(page, "text", clip=page_rect)
-            result_text = result_text.replace("\n", " ")
-
-            # check if the label is Depth Interval; if so, extract the depth interval values
-            for result in context["result"]:
-                if result["from_name"] == "label":  # noqa: SIM102
-                    if result["value"]["labels"] == ["Depth Interval"]:
-                        result_text = extract_depth_interval(result_text)
-                    elif result["value"]["labels"] == ["Coordinates"]:
-                        coordinates = extract_coordinates(
-                            result_text=result_text, rect=page_rect, page_number=page_number
-                        )
-                        result_text = str(coordinates) if coordinates is not None else ""
-
-            temp = {
-                "original_width": meta["original_width"],
-                "original_height": meta["original_height"],
-                "image_rotation": 0,
-                "value": {
-                    "x": x / meta["original_width"] * 100,
-                    "y": y / meta["original_height"] * 100,
-                    "width": w / meta["original_width"] * 100,
-                    "height": h / meta["original_height"] * 100,
-                    "rotation": 0,
-                    "text": [result_text],
-                },
-                "id": meta["id"],
-                "from_name": from_name,
-                "to_name": meta["to_name"],
-                "type": "textarea",
-                "origin": "manual",
-            }
-            return [{"result": [temp, result], "score": 0}]
-        else:
-            return []
+        logger.debug("Extracting text from %s", task["data"][value])
+        pdf_path, page_number = _parse_pdf_ref(task["data"][value])
+
+        result = context.get("result")[-1]
+        meta = self._extract_meta({**task, **result})
+
+        words, clip = extract_words(
+            pdf_path, pdf_path.stat().st_mtime_ns, page_number, meta["x"], meta["y"], meta["width"], meta["height"]
+        )
+        page_rect = fitz.Rect(clip)
+        result_text = " ".join(words)
+
+        # check if the label is Depth Interval; if so, extract the depth interval values
+        if _has_label(context["result"], "Depth Interval"):
+            result_text = extract_depth_interval(words)
+        elif _has_label(context["result"], "Coordinates"):
+            coordinates = extract_coordinates(result_text=result_text, rect=page_rect, page_number=page_number)
+            result_text = str(coordinates) if coordinates is not None else ""
+
+        temp = {
+            "original_width": meta["original_width"],
+            "original_height": meta["original_height"],
+            "image_rotation": 0,
+            "value": {
+                # the bounding box is already given in percent of the image size
+                "x": meta["x"],
+                "y": meta["y"],
+                "width": meta["width"],
+                "height": meta["height"],
+                "rotation": 0,
+                "text": [result_text],
+            },
+            "id": meta["id"],
+            "from_name": from_name,
+            "to_name": meta["to_name"],
+            "type": "textarea",
+            "origin": "manual",
+        }
+        return [{"result": [temp, result], "score": 0}]
 
     @staticmethod
     def _extract_meta(task):
@@ -153,39 +183,182 @@ class BBOXOCR(LabelStudioMLBase):
         return meta
 
 
-def extract_depth_interval(result_text: str) -> str:
-    """Extract depth interval from OCR result.
+def _has_label(results: list[dict], label: str) -> bool:
+    """Check whether any of the label-studio results assigns the given label.
+
+    Args:
+        results (list[dict]): The label-studio results from the prediction context.
+        label (str): The label name.
+
+    Returns:
+        bool: True if one of the results is a "label" result with exactly this label.
+    """
+    return any(
+        result.get("from_name") == "label" and result.get("value", {}).get("labels") == [label] for result in results
+    )
+
+
+@lru_cache(maxsize=2048)
+def _parse_pdf_ref(ref: str) -> tuple[Path, int]:
+    """Get the pdf path and page number from the url of a page image.
+
+    Args:
+        ref (str): The url of the png image of the page, ending in "<project_name>/<file_name>_<page_number>.png".
+
+    Returns:
+        tuple[Path, int]: The path to the pdf file and the page number. 0-based.
+    """
+    pdf_path_url = ref.split("_")[:-1]
+    page_number = ref.split("_")[-1]
+    page_number = int(page_number.split(".")[0])
+    pdf_path_url = "".join(pdf_path_url) + ".pdf"
+    pdf_name = pdf_path_url.split("/")[-1]
+    project_name = pdf_path_url.split("/")[-2]
+    return Path("/data/pdf/") / project_name / pdf_name, page_number
+
+
+def _get_page_words(pdf_path: Path, mtime_ns: int, page_number: int) -> PageWords:
+    """Get the size and the words of a pdf page, reusing the data of previous calls if the file did not change since.
+
+    The document is opened and the words of a page are extracted on first access only.
 
     Args:
-        result_text (str): The OCR result text.
+        pdf_path (Path): The path to the pdf file.
+        mtime_ns (int): The modification time of the pdf file.
+        page_number (int): The page number. 0-based.
+
+    Returns:
+        PageWords: The page width and height, the word bounding boxes as a float32 array of shape (N, 4) with
+            (x0, y0, x1, y1) rows, and the word texts as an object array of shape (N,).
+    """
+    key = (str(pdf_path), mtime_ns)
+    # MuPDF documents are not thread-safe, so all access to the cached documents happens under the lock.
+    with _pdf_lock:
+        entry = _pdf_cache.get(key)
+        if entry is not None:
+            _pdf_cache.move_to_end(key)
+        else:
+            entry = (fitz.open(pdf_path), {})
+            _pdf_cache[key] = entry
+            if len(_pdf_cache) > PDF_CACHE_SIZE:
+                _, (evicted, _) = _pdf_cache.popitem(last=False)
+                evicted.close()
+
+        document, pages = entry
+        page_words = pages.get(page_number)
+        if page_words is None:
+            page = document[page_number]
+            words = page.get_text("words")
+            page_words = (
+                page.rect.width,
+                page.rect.height,
+                np.array([word[:4] for word in words], dtype=np.float32).reshape(-1, 4),
+                np.array([word[4] for word in words], dtype=object),
+            )
+            pages[page_number] = page_words
+    return page_words
+
+
+@lru_cache(maxsize=1024)
+def extract_words(
+    pdf_path: Path, mtime_ns: int, page_number: int, x: float, y: float, width: float, height: float
+) -> tuple[tuple[str, ...], tuple[float, float, float, float]]:
+    """Extract the words inside a bounding box of a pdf page.
+
+    The results are cached, as the same bounding box is typically sent again when a label is edited.
+
+    Args:
+        pdf_path (Path): The path to the pdf file.
+        mtime_ns (int): The modification time of the pdf file, such that changed files are not served from cache.
+        page_number (int): The page number. 0-based.
+        x (float): The x coordinate of the bounding box, in percent of the page width.
+        y (float): The y coordinate of the bounding box, in percent of the page height.
+        width (float): The width of the bounding box, in percent of the page width.
+        height (float): The height of the bounding box, in percent of the page height.
+
+    Returns:
+        tuple[tuple[str, ...], tuple[float, float, float, float]]: The extracted words in reading order and the
+            bounding box in pdf coordinates.
+    """
+    page_width, page_height, words_xyxy, texts = _get_page_words(pdf_path, mtime_ns, page_number)
+    page_x = x * page_width / 100
+    page_y = y * page_height / 100
+    page_w = width * page_width / 100
+    page_h = height * page_height / 100
+
+    clip = (page_x, page_y, page_x + page_w, page_y + page_h)
+    return tuple(texts[select_words_in_box(words_xyxy, clip)]), clip
+
+
+def select_words_in_box(words_xyxy: np.ndarray, box: tuple[float, float, float, float]) -> np.ndarray:
+    """Select the words whose center lies inside a bounding box.
+
+    Word bounding boxes span the full line height and the full word width, so boxes that are drawn tightly around the
+    glyphs, or that cut through a word, rarely contain a word completely. Selecting by center keeps those words.
+
+    Args:
+        words_xyxy (np.ndarray): The word bounding boxes, of shape (N, 4) with (x0, y0, x1, y1) rows.
+        box (tuple[float, float, float, float]): The bounding box as (x0, y0, x1, y1), in the same coordinates.
+
+    Returns:
+        np.ndarray: A boolean mask of shape (N,) that is True for the selected words.
+    """
+    center_x = (words_xyxy[:, 0] + words_xyxy[:, 2]) / 2
+    center_y = (words_xyxy[:, 1] + words_xyxy[:, 3]) / 2
+    return (center_x >= box[0]) & (center_x <= box[2]) & (center_y >= box[1]) & (center_y <= box[3])
+
+
+def extract_depth_interval(words: Sequence[str]) -> str:
+    """Extract depth interval from the words in a bounding box.
+
+    Args:
+        words (Sequence[str]): The words in the bounding box.
 
     Returns:
         str: The extracted depth interval.
     """
-    numbers = get_numbers_from_string(result_text)
-    if len(numbers) == 1:
-        return f"start: 0 end: {numbers[0]}"
-    if len(numbers) >= 2:
-        return f"start: {numbers[0]} end: {numbers[-1]}"
-    else:
-        print(f"No number was detected in the bounding box: {result_text}. The recognized numbers are {numbers}.")
+    # Only the first and the last number are needed, so only the words at both ends are parsed.
+    first = next(((i, numbers) for i, word in enumerate(words) if (numbers := get_numbers_from_string(word))), None)
+    if first is None:
+        logger.info("No number was detected in the bounding box: %s.", " ".join(words))
         return "start: end: "
+    first_index, first_numbers = first
+
+    for word in reversed(words[first_index + 1 :]):
+        last_numbers = get_numbers_from_string(word)
+        if last_numbers:
+            return f"start: {first_numbers[0]} end: {last_numbers[-1]}"
 
+    if len(first_numbers) == 1:
+        return f"start: 0 end: {first_numbers[0]}"
+    return f"start: {first_numbers[0]} end: {first_numbers[-1]}"
 
-def get_numbers_from_string(string: str) -> float:
-    """Extract the first number from a string.
 
-    Supports various notation of numbers including scientific notation.
+def get_numbers_from_string(string: str) -> list[float]:
+    """Extract all numbers from a string.
+
+    Supports both decimal points and decimal commas. Signs and scientific notation are not recognized.
 
     Args:
-        string (str): The string to extract the number from.
+        string (str): The string to extract the numbers from.
 
     Returns:
-        float: The extracted number.
+        list[float]: The extracted numbers, as absolute values.
     """
-    numbers = re.findall("-?([0-9]+([\.,][0-9]+)?)", string)
-    numbers = [number[0].replace(",", ".") for number in numbers]
-    numbers = [abs(float(number)) for number in numbers]
+    numbers = []
+    for token in string.translate(NUMBER_TRANSLATION).split():
+        # A token such as "1.2.3" holds the numbers 1.2 and 3: at most one decimal point per number.
+        parts = token.split(".")
+        i = 0
+        while i < len(parts):
+            if not parts[i]:
+                i += 1
+            elif i + 1 < len(parts) and parts[i + 1]:
+                numbers.append(abs(float(parts[i] + "." + parts[i + 1])))
+                i += 2
+            else:
+                numbers.append(abs(float(parts[i])))
+                i += 1
     return numbers
 
 
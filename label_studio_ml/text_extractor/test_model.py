@@ -1,8 +1,16 @@
 import json
 
+import fitz
+import numpy as np
 import pytest
 
-from label_studio_ml.text_extractor.model import BBOXOCR
+from label_studio_ml.text_extractor.model import (
+    BBOXOCR,
+    extract_depth_interval,
+    extract_words,
+    get_numbers_from_string,
+    select_words_in_box,
+)
 
 
 @pytest.fixture
@@ -54,3 +62,69 @@ def test_basic_interactions(client):
     assert len(r["results"][0]["result"]) == 2
     assert r["results"][0]["result"][0]["value"]["text"][0] == "PUNYA"
     assert r["results"][0]["result"][1]["value"]["rectanglelabels"][0] == "Label2"
+
+
+def test_select_words_in_box_cutting_through_word():
+    words_xyxy = np.array([[10, 10, 50, 20], [60, 10, 100, 20]], dtype=np.float32)
+    # the box is tighter than the line height and ends in the left half of the second word
+    assert select_words_in_box(words_xyxy, (5, 12, 70, 18)).tolist() == [True, False]
+    # the box ends in the right half of the second word
+    assert select_words_in_box(words_xyxy, (5, 12, 90, 18)).tolist() == [True, True]
+    assert select_words_in_box(words_xyxy, (0, 30, 100, 40)).tolist() == [False, False]
+
+
+def test_extract_words_box_cutting_through_word(tmp_path):
+    pdf_path = tmp_path / "borehole.pdf"
+    document = fitz.open()
+    page = document.new_page(width=200, height=100)
+    page.insert_text((20, 50), "Kies Sand", fontsize=12)
+    document.save(pdf_path)
+    kies, sand = (fitz.Rect(word[:4]) for word in page.get_text("words"))
+    document.close()
+
+    def extract(box):
+        # the bounding box is passed in percent of the page size
+        x0, y0, x1, y1 = box
+        return extract_words(pdf_path, pdf_path.stat().st_mtime_ns, 0, x0 / 2, y0, (x1 - x0) / 2, y1 - y0)[0]
+
+    # the boxes are tighter than the word boxes vertically and cut through "Sand" horizontally
+    y0, y1 = kies.y0 + 2, kies.y1 - 2
+    assert extract((kies.x0 - 1, y0, sand.x0 + 0.25 * sand.width, y1)) == ("Kies",)
+    assert extract((kies.x0 - 1, y0, sand.x0 + 0.75 * sand.width, y1)) == ("Kies", "Sand")
+
+
+@pytest.mark.parametrize(
+    "string,expected",
+    [
+        ("1.2.3", [1.2, 3.0]),
+        ("1..2", [1.0, 2.0]),
+        ("1,000,000", [1.0, 0.0]),
+        ("12,5m", [12.5]),
+        ("2.5-3,75 m", [2.5, 3.75]),
+        ("", []),
+        ("-3", [3.0]),
+    ],
+)
+def test_get_numbers_from_string(string, expected):
+    assert get_numbers_from_string(string) == expected
+
+
+@pytest.mark.parametrize(
+    "words,expected",
+    [
+        # no numbers at all
+        ((), "start: end: "),
+        (("abc",), "start: end: "),
+        # a single number is read as the end of an interval starting at the surface
+        (("5m",), "start: 0 end: 5.0"),
+        (("bis", "4,5", "m"), "start: 0 end: 4.5"),
+        # several numbers in a single word
+        (("1.5-2.5m",), "start: 1.5 end: 2.5"),
+        # numbers in several words, possibly surrounded by words without numbers
+        (("1.5", "bis", "3"), "start: 1.5 end: 3.0"),
+        (("ab", "1", "2", "cd"), "start: 1.0 end: 2.0"),
+        (("1-2", "x", "3-4"), "start: 1.0 end: 4.0"),
+    ],
+)
+def test_extract_depth_interval(words, expected):
+    assert extract_depth_interval(words) == expected
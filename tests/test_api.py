@@ -1,6 +1,6 @@
 
 import pytest
-from label_studio_ml.api import _server
+from label_studio_ml.api import OrjsonProvider, _server
 
 @pytest.fixture
 def client():
@@ -48,3 +48,22 @@ def test_webhook(client):
     
     assert response.status_code == 201
 
+@pytest.fixture
+def orjson_app():
+    pytest.importorskip('orjson')
+    json_provider = _server.json
+    _server.json = OrjsonProvider(_server)
+    yield _server
+    _server.json = json_provider
+
+def test_orjson_provider(orjson_app):
+    np = pytest.importorskip('numpy')
+    data = {'b': np.float32(0.5), 'a': float('nan')}
+    assert orjson_app.json.dumps(data) == '{"a":null,"b":0.5}'
+    assert orjson_app.json.dumps(data, sort_keys=False) == '{"b":0.5,"a":null}'
+    assert orjson_app.json.dumps({'a': [1]}, indent=2) == '{\n  "a": [\n    1\n  ]\n}'
+
+    with orjson_app.test_client() as client:
+        response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json() == {'model_class': 'LabelStudioMLBase', 'status': 'UP'}